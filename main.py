@@ -1,24 +1,35 @@
 import os
 import time
+import json
 import threading
+import hmac
 import requests
-import hashlib
+from requests.adapters import HTTPAdapter
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
-from flask import Flask, Response
+from flask import Flask, Response, request
+from waitress import serve
 
 # -----------------------------
 # Global State
 # -----------------------------
-log_entries = []
-cooldown_until = None
-cooldown_lock = threading.Lock()
+log_entries = deque(maxlen=1000)
+cooldown_until_mono = 0.0
+_wake = threading.Event()
+last_recheck_mono = float("-inf")
+recheck_lock = threading.Lock()
 
 # -----------------------------
 # Configuration
 # -----------------------------
 URL_TO_MONITOR = "https://sheets.artistgrid.cx/artists.html"
 DISCORD_WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK_URL")
+DISCORD_HEADERS = {"Content-Type": "application/json"}
 CHECK_INTERVAL = 600  # seconds for HTML change check
+VERIFY_DELAY = 5  # seconds to wait before checking for a fresh snapshot
+RECHECK_TOKEN = os.getenv("RECHECK_TOKEN")
+RECHECK_MIN_INTERVAL = 60  # seconds between accepted manual rechecks
 
 env_urls = os.environ.get("ARCHIVE_URLS")
 URLS_TO_ARCHIVE = [url.strip() for url in env_urls.split(",") if url.strip()] if env_urls else [
@@ -33,54 +44,96 @@ BROWSER_USER_AGENT = (
     "Chrome/115.0.0.0 Safari/537.36"
 )
 
+# -----------------------------
+# HTTP Session
+# -----------------------------
+SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+SESSION.headers["User-Agent"] = BROWSER_USER_AGENT
+
+EXECUTOR = ThreadPoolExecutor(max_workers=max(1, len(URLS_TO_ARCHIVE)))
+
 # -----------------------------
 # Logging
 # -----------------------------
+LOG_TIMESTAMP_FORMAT = '%B %d, %Y at %H:%M GMT'
+_ts_cache = [0, ""]  # [minute since epoch, formatted timestamp]
+
 def log(msg):
-    now = datetime.now(timezone.utc)
-    timestamp = now.strftime('%B %d, %Y at %H:%M GMT')
-    entry = f"[{timestamp}] {msg}"
+    minute = int(time.time()) // 60
+    if minute != _ts_cache[0]:
+        _ts_cache[:] = [minute, time.strftime(LOG_TIMESTAMP_FORMAT, time.gmtime(minute * 60))]
+    entry = f"[{_ts_cache[1]}] {msg}"
     print(entry)
     log_entries.append(entry)
-    if len(log_entries) > 1000:
-        del log_entries[0]
 
 # -----------------------------
 # Cooldown Management
 # -----------------------------
 def in_cooldown():
-    global cooldown_until
-    with cooldown_lock:
-        return cooldown_until and datetime.now(timezone.utc) < cooldown_until
+    return time.monotonic() < cooldown_until_mono
 
 def enter_cooldown():
-    global cooldown_until
-    with cooldown_lock:
-        cooldown_until = datetime.now(timezone.utc) + timedelta(hours=1)
-        log(f"🛑 Entering cooldown until {cooldown_until.strftime('%H:%M:%S')} UTC")
+    global cooldown_until_mono
+    cooldown_until_mono = time.monotonic() + 3600
+    resume_at = datetime.now(timezone.utc) + timedelta(hours=1)
+    log(f"🛑 Entering cooldown until {resume_at.strftime('%H:%M:%S')} UTC")
 
 # -----------------------------
 # HTML Monitoring
 # -----------------------------
-def fetch_html(url):
+def read_if_changed(response, previous):
+    # Compare chunks against the previous body as they arrive and only start
+    # buffering once they diverge, so an unchanged page is never materialized.
+    previous_view = memoryview(previous) if previous is not None else None
+    offset = 0
+    buf = None
+    for chunk in response.iter_content(65536):
+        if buf is not None:
+            buf += chunk
+        elif previous_view is not None and previous_view[offset:offset + len(chunk)] == chunk:
+            offset += len(chunk)
+        else:
+            buf = bytearray(previous_view[:offset]) if previous_view is not None else bytearray()
+            buf += chunk
+    if buf is None:
+        if previous is not None and offset == len(previous):
+            return None
+        buf = bytearray(previous_view[:offset]) if previous_view is not None else bytearray()
+    return bytes(buf)
+
+def drain(response):
+    # Read a streamed body to the end so the connection goes back to the pool
+    # instead of being dropped when the response is closed.
+    for _ in response.iter_content(65536):
+        pass
+
+def fetch_html(url, previous=None, etag=None, last_modified=None):
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        return response.text
+        with SESSION.get(url, headers=headers, timeout=10, stream=True) as response:
+            if response.status_code == 304:
+                drain(response)
+                return None, response
+            response.raise_for_status()
+            return read_if_changed(response, previous), response
     except Exception as e:
         log(f"❌ Error fetching HTML: {e}")
-        return None
-
-def hash_content(content):
-    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+        return None, None
 
 def send_discord_message(message):
     if not DISCORD_WEBHOOK_URL:
         log("⚠️ DISCORD_WEBHOOK_URL not set.")
         return
     try:
-        payload = {"content": message[:1900]}
-        response = requests.post(DISCORD_WEBHOOK_URL, json=payload)
+        payload = json.dumps({"content": message[:1900]}).encode("utf-8")
+        response = SESSION.post(DISCORD_WEBHOOK_URL, data=payload, headers=DISCORD_HEADERS, timeout=10)
         response.raise_for_status()
         log("✅ Discord message sent.")
     except Exception as e:
@@ -91,7 +144,7 @@ def send_discord_message(message):
 # -----------------------------
 def is_recent_snapshot(url, max_age_seconds=3600):
     try:
-        response = requests.get("https://archive.org/wayback/available", params={"url": url}, timeout=30)
+        response = SESSION.get("https://archive.org/wayback/available", params={"url": url}, timeout=30)
         data = response.json()
         snapshot = data.get("archived_snapshots", {}).get("closest")
         if not snapshot:
@@ -101,89 +154,134 @@ def is_recent_snapshot(url, max_age_seconds=3600):
         age = (datetime.now(timezone.utc) - snapshot_time).total_seconds()
         return age <= max_age_seconds, snapshot["url"]
     except Exception as e:
-        log(f"⚠️ Failed to check snapshot recency: {e}")
+        log(f"⚠️ Failed to check snapshot recency for {url}: {e}")
         return False, None
 
-def archive_url(url):
+def submit_save(url):
     if in_cooldown():
         log(f"🚫 Skipping {url} — system is in cooldown.")
-        return
+        return False
 
-    headers = {"User-Agent": BROWSER_USER_AGENT}
     try:
         log(f"📤 Submitting URL: {url}")
-        response = requests.get("https://web.archive.org/save/" + url, headers=headers, timeout=60)
-        log(f"📦 Status code: {response.status_code}")
-        log(f"🌐 Archive/Status URL: {response.url}")
+        response = SESSION.get("https://web.archive.org/save/" + url, timeout=60)
+        log(f"📦 Status code for {url}: {response.status_code}")
+        log(f"🌐 Archive/Status URL for {url}: {response.url}")
 
         if response.status_code in [429, 503]:
             log(f"🚷 Rate limited or service unavailable for {url} (status {response.status_code})")
             enter_cooldown()
-            return
-
-        time.sleep(5)
-        recent, snapshot_url = is_recent_snapshot(url)
-        if recent:
-            log(f"✅ Archived successfully and snapshot is recent: {snapshot_url}")
-        else:
-            log("⚠️ Snapshot not recent (older than 1 hour). Rate-limited or error?")
-            if snapshot_url:
-                log(f"🕓 Last available snapshot: {snapshot_url}")
+            return False
+        return True
     except requests.exceptions.Timeout:
-        log("⏰ Timeout occurred.")
+        log(f"⏰ Timeout occurred for {url}.")
         enter_cooldown()
     except requests.exceptions.RequestException as e:
-        log(f"❌ Request error: {e}")
+        log(f"❌ Request error for {url}: {e}")
         enter_cooldown()
+    return False
+
+def verify_save(url):
+    recent, snapshot_url = is_recent_snapshot(url)
+    if recent:
+        log(f"✅ Archived {url} successfully and snapshot is recent: {snapshot_url}")
+    else:
+        log(f"⚠️ Snapshot for {url} not recent (older than 1 hour). Rate-limited or error?")
+        if snapshot_url:
+            log(f"🕓 Last available snapshot for {url}: {snapshot_url}")
+
+def archive_url(url):
+    if submit_save(url):
+        timer = threading.Timer(VERIFY_DELAY, verify_save, args=(url,))
+        timer.daemon = True
+        timer.start()
 
 def archive_all_urls():
     log("🚀 Archiving all configured URLs due to detected content change.")
-    for url in URLS_TO_ARCHIVE:
-        archive_url(url)
+    list(EXECUTOR.map(archive_url, URLS_TO_ARCHIVE))
 
 # -----------------------------
 # Monitor + Archive on Change Loop
 # -----------------------------
 def monitor_and_archive_loop():
     log(f"🔍 Monitoring HTML content at: {URL_TO_MONITOR}")
-    last_html = fetch_html(URL_TO_MONITOR)
-    if last_html is None:
-        log("❌ Failed to get initial HTML content. Exiting monitor.")
-        return
-
-    last_hash = hash_content(last_html)
+    last_body = None
+    etag = None
+    last_modified = None
 
+    next_poll = time.monotonic()
     while True:
-        time.sleep(CHECK_INTERVAL)
-        current_html = fetch_html(URL_TO_MONITOR)
-        if current_html is None:
-            log("⚠️ Failed to fetch. Skipping.")
+        _wake.wait(max(0, next_poll - time.monotonic()))
+        _wake.clear()
+        next_poll = time.monotonic() + CHECK_INTERVAL
+        current_body, response = fetch_html(URL_TO_MONITOR, last_body, etag, last_modified)
+        if response is None:
+            if last_body is None:
+                log("❌ Failed to get initial HTML content. Retrying on the next check.")
+            else:
+                log("⚠️ Failed to fetch. Skipping.")
             continue
+        if response.status_code != 304:
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
 
-        current_hash = hash_content(current_html)
-        if current_hash != last_hash:
-            log("⚠️ HTML content changed!")
-            send_discord_message(f"⚠️ Content changed! <{URL_TO_MONITOR}>")
-            archive_all_urls()
-            last_hash = current_hash
+        if current_body is None:
+            continue
+        if last_body is None:
+            last_body = current_body
+            continue
+
+        log("⚠️ HTML content changed!")
+        send_discord_message(f"⚠️ Content changed! <{URL_TO_MONITOR}>")
+        archive_all_urls()
+        last_body = current_body
 
 # -----------------------------
 # Flask Web App
 # -----------------------------
 app = Flask(__name__)
 
+LOG_PAGE_PREFIX = (
+    b"<html><head><title>Monitor & Archiver Log</title></head>"
+    b"<body style='background-color:black; color:white; font-family:monospace; white-space:pre-wrap;'>"
+)
+LOG_PAGE_SUFFIX = b"</body></html>"
+
+def stream_log(entries):
+    yield LOG_PAGE_PREFIX
+    for i, entry in enumerate(entries):
+        if i:
+            yield b"\n"
+        yield entry.encode("utf-8", "replace")
+    yield LOG_PAGE_SUFFIX
+
 @app.route("/")
 @app.route("/index.html")
 def show_log():
-    content = "<html><head><title>Monitor & Archiver Log</title></head>"
-    content += "<body style='background-color:black; color:white; font-family:monospace; white-space:pre-wrap;'>"
-    content += "\n".join(log_entries)
-    content += "</body></html>"
-    return Response(content, mimetype='text/html')
+    # Snapshot the deque so concurrent log() calls can't mutate it mid-stream.
+    return Response(stream_log(tuple(log_entries)), mimetype='text/html')
+
+@app.route("/recheck", methods=["POST"])
+def recheck():
+    global last_recheck_mono
+    if not RECHECK_TOKEN:
+        return Response("Recheck is disabled.\n", status=403, mimetype='text/plain')
+    token = request.headers.get("X-Recheck-Token", "")
+    if not hmac.compare_digest(token.encode("utf-8"), RECHECK_TOKEN.encode("utf-8")):
+        return Response("Forbidden.\n", status=403, mimetype='text/plain')
+
+    with recheck_lock:
+        now = time.monotonic()
+        if _wake.is_set() or now - last_recheck_mono < RECHECK_MIN_INTERVAL:
+            return Response("Recheck already requested recently.\n", status=429, mimetype='text/plain')
+        last_recheck_mono = now
+        log("🔁 Manual recheck requested.")
+        _wake.set()
+    return Response("Recheck scheduled.\n", mimetype='text/plain')
 
 # -----------------------------
 # Main Entry Point
 # -----------------------------
 if __name__ == "__main__":
     threading.Thread(target=monitor_and_archive_loop, daemon=True).start()
-    app.run(host="0.0.0.0", port=8000)
+    serve(app, host="0.0.0.0", port=8000, threads=4)